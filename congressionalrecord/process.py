@@ -1,18 +1,29 @@
 import argparse
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import datetime
+from itertools import islice
 import json
 import logging
-import re
+import mmap
+import os
 from pathlib import Path
+import sys
 
 from tqdm import tqdm
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Estimated from 2010-2020:
 # Of the 100 most commonly appearing "titles" in the data, we collect speeches given by
 # members of congress (i.e., that have a bioguide_id). We manually inspect the 50 with 
 # the lowest unigram entropy and include those that are strictly procedural and have at
 # least 10 associated speeches
-PROCEDURAL_TITLES = [
+PROCEDURAL_TITLES = frozenset([
     "APPOINTMENT OF ACTING PRESIDENT PRO TEMPORE",
     "HOUR OF MEETING ON TOMORROW",
     "ADJOURNMENT",
@@ -29,14 +40,48 @@ PROCEDURAL_TITLES = [
     "APPOINTMENTS",
     "GENERAL LEAVE",
     "ADJOURNMENT UNTIL 10 A.M. TOMORROW",   
-]
+])
 
 
+# Months appear as full names in the record header, e.g. "July", but accept
+# abbreviations, other casings, and numbers as well
 MONTH_MAP = {
-    datetime.date(2020, i, 1).strftime('%B'): f"{i:02}"
+    variant: f"{i:02}"
     for i in range(1, 13)
+    for month in (
+        datetime.date(2020, i, 1).strftime('%B'),
+        datetime.date(2020, i, 1).strftime('%b'),
+    )
+    for variant in (month, month.lower(), month.upper(), str(i), f"{i:02}")
+}
+
+# Days appear as written in the record header, e.g. "5", but accept "05" as well
+DAY_MAP = {
+    day: f"{i:02}"
+    for i in range(1, 32)
+    for day in (str(i), f"{i:02}")
 }
 
+# Files at least this many bytes are memory-mapped rather than read into memory
+MMAP_MIN_SIZE = 64 * 1024
+
+# Bytes to buffer before flushing speeches to the output file
+OUTPUT_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Speech fields that take few distinct values across the data, so returned
+# speeches can share one copy of each value
+SHARED_FIELDS = (
+    "title",
+    "date",
+    "chamber",
+    "speaker_id",
+    "party",
+    "first_name",
+    "last_name",
+    "gender",
+    "state",
+)
+
 
 def load_json(fpath):
     """
@@ -47,24 +92,74 @@ def load_json(fpath):
     Returns:
         python object parsed from json
     """
-    with open(fpath, "r") as infile:
-        return json.load(infile)
+    if orjson is None:
+        with open(fpath, "r") as infile:
+            return json.load(infile)
+    with open(fpath, "rb") as infile:
+        if os.fstat(infile.fileno()).st_size < MMAP_MIN_SIZE:
+            return orjson.loads(infile.read())
 
+        # parse straight from the page cache, skipping the copy into `bytes`
+        with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as buffer:
+                return orjson.loads(buffer)
 
-def filter_terms(date, terms):
+
+def dump_json_line(obj):
+    """
+    Serialize an object to a line of a jsonlist
+    Args:
+        obj (python object):
+            Object to serialize
+    Returns:
+        utf-8 encoded json followed by a newline, as bytes
+    """
+    if orjson is None:
+        return (json.dumps(obj) + "\n").encode("utf-8")
+    return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def collapse_whitespace(text):
+    """
+    Replace each run of whitespace with a single space, equivalent to
+    `re.sub(r"\s+", " ", text)` but done with (much faster) C-level str methods
+    Args:
+        text (string):
+            Text to clean
+    Returns:
+        cleaned text (string)
+    """
+    words = text.split()
+    if not words:
+        return " " if text else ""
+
+    collapsed = " ".join(words)
+    if text[0].isspace():
+        collapsed = " " + collapsed
+    if text[-1].isspace():
+        collapsed = collapsed + " "
+    return collapsed
+
+
+def filter_terms(date, terms, term_starts):
     """
     Filter the terms a legislator to a date
     Args:
         date (string in YYYY-MM-DD format):
             Date by which to select the term
         terms (list):
-            List of dicts, each with a "start" and "end" key in the same format
+            List of dicts, each with a "start" and "end" key in the same format,
+            sorted by "start"
+        term_starts (list):
+            The "start" of each element of `terms`, used to bisect on `date`
     Returns:
-        First element of `term` that intersects with `date`
+        Latest element of `terms` that intersects with `date`
     """
-    for term in reversed(terms):
-        if term["start"] <= date <= term["end"]: 
-            return term
+    # every term up to `idx` starts on or before `date`; the latest usually covers
+    # it, but step back in case an earlier, overlapping term runs past it
+    for idx in range(bisect_right(term_starts, date) - 1, -1, -1):
+        if date <= terms[idx]["end"]:
+            return terms[idx]
 
     last_term = terms[-1]
     logging.warning(
@@ -82,33 +177,278 @@ def process_legislator_data(raw_data):
             Legislator data from 
 
     Returns:
-        dict where key is Bioguide ID and values are legislator info
+        dict where key is Bioguide ID and values are legislator info. Each term
+        also carries the speaker fields to attach to a speech given during it:
+        under "speaker_info", and under "gop_dem_speaker_info" with the party
+        set to the caucus for those who caucus with Republicans/Democrats (None
+        if neither applies)
     """
     legislator_data = {}
     for leg in raw_data:
         speaker_id = leg["id"]["bioguide"]
+        first_name = leg["name"]["first"]
+        last_name = leg["name"]["last"]
+        gender = leg["bio"]["gender"]
+
+        terms = []
+        for term in sorted(leg["terms"], key=lambda term: term["start"]):
+            # set the party
+            party = term.get("party", None)
+            gop_dem_party = party
+            if gop_dem_party not in ["Republican", "Democrat"]:
+                gop_dem_party = term.get("caucus", None) # set party to caucus
+
+            speaker_info = {
+                "speaker_id": speaker_id,
+                "party": party,
+                "first_name": first_name,
+                "last_name": last_name,
+                "gender": gender,
+                "state": term["state"],
+            }
+            gop_dem_speaker_info = None
+            if gop_dem_party in ["Republican", "Democrat"]: # if not matched, drop
+                gop_dem_speaker_info = {**speaker_info, "party": gop_dem_party}
+
+            terms.append({
+                **term,
+                "speaker_info": speaker_info,
+                "gop_dem_speaker_info": gop_dem_speaker_info,
+            })
 
         legislator_data[speaker_id] = {
-            "first_name": leg["name"]["first"],
-            "last_name": leg["name"]["last"],
-            "gender": leg["bio"]["gender"],
+            "first_name": first_name,
+            "last_name": last_name,
+            "gender": gender,
             
-            "terms": leg["terms"],
+            "terms": terms,
+            "term_starts": [term["start"] for term in terms],
         }
 
     return legislator_data
 
+def iter_speech_dirs(speech_data_dir, start=None, end=None):
+    """
+    Find the directories of json speech data for each day, without listing the
+    files inside them
+    Args:
+        speech_data_dir (str or pathlib.Path):
+            Data directory in the format made by `download.py`, i.e.,
+            `<year>/CREC-<YYYY-MM-DD>/json/*.json`
+        start (string in YYYY-MM-DD format):
+            Earliest date to include. If not specified, no lower bound
+        end (string in YYYY-MM-DD format):
+            Latest date to include. If not specified, no upper bound
+    Yields:
+        (date, path) tuples, in date order
+    """
+    with os.scandir(speech_data_dir) as entries:
+        year_dirs = sorted(
+            entry.path for entry in entries
+            if entry.is_dir() and len(entry.name) == 4 and entry.name.isdigit()
+        )
+
+    for year_dir in year_dirs:
+        year = os.path.basename(year_dir)
+        if (start and year < start[:4]) or (end and year > end[:4]):
+            continue
+
+        with os.scandir(year_dir) as entries:
+            day_dirs = sorted(
+                (entry.name.replace("CREC-", ""), os.path.join(entry.path, "json"))
+                for entry in entries if entry.is_dir()
+            )
+        for date, json_dir in day_dirs:
+            if (start and date < start) or (end and date > end):
+                continue
+            if os.path.isdir(json_dir):
+                yield date, json_dir
+
+
+def iter_speech_paths(speech_data_dir, start=None, end=None):
+    """
+    Lazily list the json speech data between two dates
+    Args:
+        speech_data_dir (str or pathlib.Path):
+            Data directory in the format made by `download.py`
+        start (string in YYYY-MM-DD format):
+            Earliest date to include. If not specified, no lower bound
+        end (string in YYYY-MM-DD format):
+            Latest date to include. If not specified, no upper bound
+    Yields:
+        paths (str) to json speech data
+    """
+    for _, json_dir in iter_speech_dirs(speech_data_dir, start, end):
+        with os.scandir(json_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".json"):
+                    yield entry.path
+
+
+def process_speech_file(
+    path,
+    legislator_data,
+    remove_procedural=False,
+    restrict_to_gop_dem=False,
+    as_jsonl=False,
+    ):
+    """
+    Clean the speeches in a single json file and match them with the legislator data
+    Args:
+        path (str or pathlib.Path):
+            Path to json speech data
+        legislator_data (dict):
+            Dictionary mapping bioguide ids to legislator data
+        remove_procedural (bool):
+            Remove procedural speeches, as defined by `PROCEDURAL_TITLES`
+        restrict_to_gop_dem (bool):
+            Keep only Republicans/Democrats, or those who caucus with them (e.g., Sanders)
+        as_jsonl (bool):
+            Serialize each speech to a line of a jsonlist
+    Returns:
+        list of dicts, or of bytes if `as_jsonl`
+    """
+    speeches = []
+    data = load_json(path)
+
+    if remove_procedural and data["title"] in PROCEDURAL_TITLES:
+        return speeches
+
+    # Collect dates
+    header = data["header"]
+    date = f"{header['year']}-{MONTH_MAP[header['month']]}-{DAY_MAP[header['day']]}"
+
+    # Get speech content
+    speaker_info_key = (
+        "gop_dem_speaker_info" if restrict_to_gop_dem else "speaker_info"
+    )
+    candidates = [
+        speech for speech in data["content"]
+        if (
+            speech["kind"] == "speech" and 
+            speech["speaker_bioguide"] != "None" and 
+            speech["speaker_bioguide"]
+        )
+    ]
+    doc_id, source_file, title = data["id"], str(path), data["title"]
+    chamber = header["chamber"]
+    speaker_infos = {} # the date is fixed, so each speaker's term is too
+    for speech in candidates:
+        speaker_id = speech["speaker_bioguide"]
+        if speaker_id not in speaker_infos:
+            legislator = legislator_data[speaker_id]
+            term = filter_terms(date, legislator["terms"], legislator["term_starts"])
+            speaker_infos[speaker_id] = term[speaker_info_key]
+        speaker_info = speaker_infos[speaker_id]
+        if speaker_info is None:
+            continue
+
+        # clean text, which often begins with the speaker name
+        speaker, text = speech["speaker"], speech["text"]
+        if text.startswith(speaker):
+            text = text[len(speaker):]
+        else:
+            text = text.replace(speaker, "", 1)
+        text = text.lstrip(". ")
+
+        clean_data = {
+            # speech info
+            "id": f"{doc_id}_{speech['itemno']}",
+            "source_file": source_file,
+            "title": title,
+            "date": date,
+            "text": collapse_whitespace(text),
+            
+            "chamber": chamber,
+
+            # legislator info
+            **speaker_info,
+        }
+        speeches.append(dump_json_line(clean_data) if as_jsonl else clean_data)
+
+    return speeches
+
+
+# Arguments shared by every call to `process_speech_file` in a worker process.
+# Stays empty in the main process; each worker fills it once, via the pool
+# initializer `init_worker`, and keeps it for its lifetime, so the legislator data
+# is not re-sent with each task
+worker_kwargs = {}
+
+
+def init_worker(kwargs):
+    """
+    Set up a worker process, storing the arguments shared by all its tasks in the
+    module-level `worker_kwargs`
+    Args:
+        kwargs (dict):
+            Keyword arguments to `process_speech_file`, other than `path`
+    Returns:
+        None
+    """
+    worker_kwargs.update(kwargs)
+
+
+def process_speech_files_in_worker(paths):
+    """
+    Clean a chunk of speech files in a worker set up by `init_worker`
+    Args:
+        paths (list of str or pathlib.Path):
+            Paths to json speech data
+    Returns:
+        list with the result of `process_speech_file` for each path
+    """
+    return [process_speech_file(path, **worker_kwargs) for path in paths]
+
+
+def map_in_windows(executor, paths, max_pending, chunksize=64):
+    """
+    Process speech files in an executor, like `executor.map`, but only pull
+    enough of `paths` to keep `max_pending` chunks in flight, so that a
+    generator of paths is consumed as results come back
+    Args:
+        executor (concurrent.futures.Executor):
+            Executor whose workers were set up by `init_worker`
+        paths (iterable of str or pathlib.Path):
+            Paths to json speech data
+        max_pending (int):
+            Maximum number of chunks submitted but not yet yielded
+        chunksize (int):
+            Number of paths sent to a worker at a time
+    Yields:
+        result of `process_speech_file` for each path, in order
+    """
+    paths = iter(paths)
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < max_pending:
+                chunk = list(islice(paths, chunksize))
+                if not chunk:
+                    break
+                pending.append(executor.submit(process_speech_files_in_worker, chunk))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+    finally:
+        # on error or early close, drop the chunks that have not started yet
+        # (`executor.shutdown(cancel_futures=True)` needs python 3.9)
+        for future in pending:
+            future.cancel()
+
+
 def process_and_speech_data(
     input_paths,
     legislator_data=None,
     output_fpath=None,
     remove_procedural=False,
     restrict_to_gop_dem=False,
+    n_jobs=1,
     ):
     """
     Clean and save/return speech data matched with the legislator data
     Args:
-        input_paths (list of str or pathlib.Path):
+        input_paths (iterable of str or pathlib.Path):
             Paths to json speech data
         legislator_data (dict):
             Dictionary mapping bioguide ids to legislator data
@@ -118,69 +458,64 @@ def process_and_speech_data(
             Remove procedural speeches, as defined by `PROCEDURAL_TITLES`
         restrict_to_gop_dem (bool):
             Keep only Republicans/Democrats, or those who caucus with them (e.g., Sanders)
+        n_jobs (int):
+            Number of processes over which to split the files. If 1, runs in the
+            current process; if None, uses all available cores
     Returns:
         None (if `output_fpath` specified), else a list of dicts
     """
-    speeches = [] if output_fpath else None
-    for i, path in enumerate(tqdm(input_paths)):
-        data = load_json(path)
+    kwargs = {
+        "legislator_data": legislator_data,
+        "remove_procedural": remove_procedural,
+        "restrict_to_gop_dem": restrict_to_gop_dem,
+        # serializing in the workers means only bytes are sent back to this process
+        "as_jsonl": bool(output_fpath),
+    }
+    speeches = None if output_fpath else []
+    outfile = (
+        open(output_fpath, "wb", buffering=OUTPUT_BUFFER_SIZE)
+        if output_fpath else None
+    )
+    shared_values = {}
+    executor = None
+    results = None
+    try:
+        if n_jobs != 1 and sys.version_info < (3, 7):
+            logging.warning(
+                "Processing in parallel needs python 3.7 or later, using one process"
+            )
+            n_jobs = 1
 
-        if remove_procedural and data["title"] in PROCEDURAL_TITLES:
-            continue
+        if n_jobs == 1:
+            results = (process_speech_file(path, **kwargs) for path in input_paths)
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=n_jobs, initializer=init_worker, initargs=(kwargs,)
+            )
+            n_workers = n_jobs or os.cpu_count() or 1
+            results = map_in_windows(executor, input_paths, max_pending=2 * n_workers)
+
+        total = len(input_paths) if hasattr(input_paths, "__len__") else None
+        for file_speeches in tqdm(results, total=total, mininterval=1.0):
+            if outfile is not None:
+                outfile.writelines(file_speeches)
+            else:
+                for clean_data in file_speeches:
+                    for field in SHARED_FIELDS:
+                        value = clean_data[field]
+                        clean_data[field] = shared_values.setdefault(value, value)
+                speeches.extend(file_speeches)
+    except BaseException:
+        # don't wait on the rest of the files before surfacing the error
+        if results is not None:
+            results.close()
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if outfile is not None:
+            outfile.close()
 
-        # Collect dates
-        date = "{year}-{month}-{day}".format(
-            year=data["header"]["year"],
-            month=MONTH_MAP[data["header"]["month"]],
-            day=f"{int(data['header']['day']):02}",
-        )
-        assert(len(date) == len("XXXX-XX-XX"))
-
-        # Get speech content
-        for speech in data["content"]:
-            if (
-                speech["kind"] == "speech" and 
-                speech["speaker_bioguide"] != "None" and 
-                speech["speaker_bioguide"]
-            ):
-                # clean text, which often begins with the speaker name
-                text = speech["text"].replace(speech["speaker"], "").lstrip(". ")
-                speaker_id = speech["speaker_bioguide"]
-                legislator = legislator_data[speaker_id]
-                term = filter_terms(date, legislator["terms"])
-                
-                # set the party
-                party = term.get("party", None)
-                if restrict_to_gop_dem and party not in ["Republican", "Democrat"]:
-                    party = term.get("caucus", None) # set party to caucus
-                    if party not in ["Republican", "Democrat"]: # if not matched, drop
-                        continue
-                    
-                clean_data = {
-                    # speech info
-                    "id": f"{data['id']}_{speech['itemno']}",
-                    "source_file": str(path),
-                    "title": data["title"],
-                    "date": date,
-                    "text": re.sub("\s+", " ", text),
-                    
-                    "chamber": data["header"]["chamber"],
-
-                    # legislator info
-                    "speaker_id": speaker_id,
-                    "party": party,
-                    "first_name": legislator["first_name"],
-                    "last_name": legislator["last_name"],
-                    "gender": legislator["gender"],
-                    "state": term["state"],
-                }
-
-                if output_fpath is not None:
-                    with open(out_fpath, mode="w" if i == 0 else "a") as outfile:
-                        outfile.write(json.dumps(clean_data)+"\n")
-                else:
-                    speeches.append(clean_data)
-    
     return speeches
 
 if __name__ == "__main__":
@@ -229,6 +564,12 @@ if __name__ == "__main__":
         default=False,
         help="Keep only Republicans & Democrats, and those who caucus with them"
     )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=None,
+        help="Number of processes to use, defaults to all available cores"
+    )
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
@@ -240,14 +581,15 @@ if __name__ == "__main__":
         raw_legislator_data.extend(load_json(path))
     legislator_data = process_legislator_data(raw_legislator_data)
 
-    # Flatten & clean speech data
-    speech_paths = list(Path(args.speech_data_dir).glob("[0-9][0-9][0-9][0-9]/**/*.json"))
-
     # Filter the dates
-    dates = [(p, p.parent.parent.name.replace("CREC-", "")) for p in speech_paths]
-    start = args.start or min(d for _, d in dates)
-    end = args.end or max(d for _, d in dates)
-    speech_paths = [p for p, d in dates if start <= d <= end]
+    start, end = args.start, args.end
+    if start is None or end is None:
+        dates = [d for d, _ in iter_speech_dirs(args.speech_data_dir, start, end)]
+        start = start or dates[0]
+        end = end or dates[-1]
+
+    # Flatten & clean speech data
+    speech_paths = iter_speech_paths(args.speech_data_dir, start, end)
 
     out_fpath = Path(args.output_dir, f"speeches-{start}-to-{end}.jsonl")
 
@@ -257,4 +599,5 @@ if __name__ == "__main__":
         output_fpath=out_fpath,
         remove_procedural=args.remove_procedural_speeches,
         restrict_to_gop_dem=args.restrict_to_gop_dem,
+        n_jobs=args.n_jobs,
     )
@@ -1,5 +1,6 @@
 import unittest
 from tests.test_parser import *
+from tests.test_process import *
 
 if __name__ == '__main__':
     unittest.main()
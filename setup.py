@@ -22,5 +22,8 @@ setup(
         'future',
         'tqdm',
         ],
+    extras_require={
+        'fast': ['orjson >= 3.5.0'],
+        },
         zip_safe=False
     )
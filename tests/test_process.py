@@ -0,0 +1,286 @@
+import unittest
+from congressionalrecord import process
+import os
+import random
+import re
+import shutil
+import tempfile
+import json
+import logging
+
+logging.basicConfig(filename='tests.log', level=logging.DEBUG)
+
+"""
+These tests make sure that the steps of turning parsed
+json into a jsonlist of speeches behave like the simpler
+code they replaced.
+"""
+
+FIXTURE_DIR = 'tests/test_files/CREC-2005-07-20/json'
+
+
+def make_legislator(bioguide, terms):
+    return {
+        'id': {'bioguide': bioguide},
+        'name': {'first': 'First', 'last': bioguide},
+        'bio': {'gender': 'F'},
+        'terms': terms,
+    }
+
+
+class testCollapseWhitespace(unittest.TestCase):
+
+    def test_matches_regex(self):
+        """
+        collapse_whitespace agrees with re.sub on random text
+        """
+        rng = random.Random(0)
+        alphabet = ['a', 'b', '.', ' ', ' ', '\n', '\t', '\r', '\x0b', ' ', ' ']
+        for _ in range(20000):
+            text = ''.join(
+                rng.choice(alphabet) for _ in range(rng.randint(0, 10)))
+            self.assertEqual(
+                process.collapse_whitespace(text),
+                re.sub(r'\s+', ' ', text),
+                msg='Mismatch on {0!r}'.format(text))
+
+    def test_edges(self):
+        for text in ['', ' ', ' \n\t ', '  a  b  ', '\na', 'a\n', 'a']:
+            self.assertEqual(
+                process.collapse_whitespace(text),
+                re.sub(r'\s+', ' ', text),
+                msg='Mismatch on {0!r}'.format(text))
+
+
+class testFilterTerms(unittest.TestCase):
+
+    def setUp(self):
+        self.terms = [
+            {'start': '2001-01-03', 'end': '2003-01-03'},
+            {'start': '2003-01-03', 'end': '2005-01-03'},
+            {'start': '2007-01-04', 'end': '2009-01-03'},
+        ]
+        self.starts = [t['start'] for t in self.terms]
+
+    def filter(self, date):
+        return process.filter_terms(date, self.terms, self.starts)
+
+    def test_inside_term(self):
+        self.assertIs(self.filter('2002-06-01'), self.terms[0])
+        self.assertIs(self.filter('2008-06-01'), self.terms[2])
+
+    def test_date_equal_to_start(self):
+        """
+        On a changeover day, the later term wins
+        """
+        self.assertIs(self.filter('2003-01-03'), self.terms[1])
+        self.assertIs(self.filter('2001-01-03'), self.terms[0])
+        self.assertIs(self.filter('2007-01-04'), self.terms[2])
+
+    def test_date_in_gap(self):
+        self.assertIs(self.filter('2006-01-01'), self.terms[-1])
+
+    def test_date_before_first_term(self):
+        self.assertIs(self.filter('1999-01-01'), self.terms[-1])
+
+    def test_date_after_last_term(self):
+        self.assertIs(self.filter('2010-01-01'), self.terms[-1])
+
+    def test_overlapping_terms(self):
+        """
+        An earlier term still running covers the date when the latest one has ended
+        """
+        terms = [
+            {'start': '2001-01-01', 'end': '2010-01-01'},
+            {'start': '2002-01-01', 'end': '2003-01-01'},
+        ]
+        starts = [t['start'] for t in terms]
+        self.assertIs(process.filter_terms('2005-01-01', terms, starts), terms[0])
+        self.assertIs(process.filter_terms('2002-06-01', terms, starts), terms[1])
+
+
+class testDateMaps(unittest.TestCase):
+
+    def test_months(self):
+        for month in ['July', 'Jul', 'july', 'JULY', '7', '07']:
+            self.assertEqual(process.MONTH_MAP[month], '07')
+        self.assertEqual(process.MONTH_MAP['December'], '12')
+
+    def test_days(self):
+        self.assertEqual(process.DAY_MAP['5'], '05')
+        self.assertEqual(process.DAY_MAP['05'], '05')
+        self.assertEqual(process.DAY_MAP['31'], '31')
+        self.assertNotIn('0', process.DAY_MAP)
+        self.assertNotIn('32', process.DAY_MAP)
+
+
+class testSpeechPaths(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.dates = ['2004-12-31', '2005-01-03', '2005-07-20', '2006-02-01']
+        for date in self.dates:
+            json_dir = os.path.join(
+                self.data_dir, date[:4], 'CREC-{0}'.format(date), 'json')
+            os.makedirs(json_dir)
+            for name in ['a.json', 'b.json', 'notes.txt']:
+                open(os.path.join(json_dir, name), 'w').close()
+        # downloaded, but never parsed to json
+        os.makedirs(os.path.join(self.data_dir, '2005', 'CREC-2005-03-01', 'html'))
+        # not a year
+        os.makedirs(os.path.join(self.data_dir, 'output', 'CREC-2005-07-20', 'json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_all_dates(self):
+        dates = [d for d, _ in process.iter_speech_dirs(self.data_dir)]
+        self.assertEqual(dates, self.dates)
+
+    def test_inclusive_bounds(self):
+        dates = [d for d, _ in process.iter_speech_dirs(
+            self.data_dir, '2005-01-03', '2005-07-20')]
+        self.assertEqual(dates, ['2005-01-03', '2005-07-20'])
+
+    def test_paths(self):
+        paths = list(process.iter_speech_paths(
+            self.data_dir, start='2005-01-01'))
+        self.assertEqual(len(paths), 6)
+        for path in paths:
+            self.assertTrue(path.endswith('.json'))
+            self.assertGreaterEqual(path, os.path.join(self.data_dir, '2005'))
+
+
+class testProcessSpeechData(unittest.TestCase):
+
+    def setUp(self):
+        self.paths = sorted(
+            os.path.join(FIXTURE_DIR, name) for name in os.listdir(FIXTURE_DIR))
+        bioguides = set()
+        for path in self.paths:
+            with open(path, 'r') as infile:
+                for item in json.load(infile)['content']:
+                    if item['kind'] == 'speech' and item['speaker_bioguide']:
+                        bioguides.add(item['speaker_bioguide'])
+        parties = ['Republican', 'Democrat', 'Independent']
+        raw_data = [
+            make_legislator(bioguide, [
+                {'start': '2003-01-07', 'end': '2005-01-03',
+                 'party': 'Democrat', 'state': 'VT'},
+                {'start': '2005-01-04', 'end': '2007-01-03',
+                 'party': parties[i % 3], 'caucus': 'Democrat', 'state': 'NY'},
+            ])
+            for i, bioguide in enumerate(sorted(bioguides))
+        ]
+        self.legislator_data = process.process_legislator_data(raw_data)
+
+    def run_process(self, **kwargs):
+        return process.process_and_speech_data(
+            self.paths, legislator_data=self.legislator_data, **kwargs)
+
+    def test_speeches(self):
+        speeches = self.run_process()
+        self.assertGreater(len(speeches), 0, msg='No speeches!')
+        for speech in speeches:
+            self.assertEqual(speech['date'], '2005-07-20')
+            self.assertEqual(speech['state'], 'NY')
+            self.assertNotIn('  ', speech['text'])
+
+    def test_parallel_matches_serial(self):
+        for kwargs in [{}, {'remove_procedural': True}, {'restrict_to_gop_dem': True}]:
+            serial = self.run_process(n_jobs=1, **kwargs)
+            parallel = self.run_process(n_jobs=2, **kwargs)
+            self.assertEqual(serial, parallel)
+
+    def test_restrict_to_gop_dem(self):
+        speeches = self.run_process(restrict_to_gop_dem=True)
+        self.assertEqual(
+            {s['party'] for s in speeches}, {'Republican', 'Democrat'})
+
+    def test_output_file(self):
+        out_dir = tempfile.mkdtemp()
+        try:
+            out_fpath = os.path.join(out_dir, 'speeches.jsonl')
+            self.assertIsNone(self.run_process(output_fpath=out_fpath, n_jobs=2))
+            with open(out_fpath, 'r') as infile:
+                written = [json.loads(line) for line in infile]
+            self.assertEqual(written, self.run_process())
+        finally:
+            shutil.rmtree(out_dir)
+
+    def test_stdlib_json_fallback(self):
+        """
+        Without orjson, files load and the jsonlist parses the same
+        """
+        out_dir = tempfile.mkdtemp()
+        orjson = process.orjson
+        try:
+            out_fpath = os.path.join(out_dir, 'speeches.jsonl')
+            expected = self.run_process()
+            loaded = [process.load_json(path) for path in self.paths]
+
+            process.orjson = None
+            self.assertEqual([process.load_json(path) for path in self.paths], loaded)
+            self.run_process(output_fpath=out_fpath)
+            with open(out_fpath, 'r') as infile:
+                written = [json.loads(line) for line in infile]
+            self.assertEqual(written, expected)
+        finally:
+            process.orjson = orjson
+            shutil.rmtree(out_dir)
+
+
+class testSpeakerName(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.legislator_data = process.process_legislator_data([
+            make_legislator('S000001', [
+                {'start': '2005-01-04', 'end': '2007-01-03',
+                 'party': 'Democrat', 'state': 'NY'},
+            ])
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def clean_text(self, text):
+        path = os.path.join(self.data_dir, 'speech.json')
+        with open(path, 'w') as outfile:
+            json.dump({
+                'id': 'CREC-2005-07-20-pt1-PgH6109',
+                'title': 'A BILL',
+                'header': {'year': '2005', 'month': 'July', 'day': '20',
+                           'chamber': 'House'},
+                'content': [{
+                    'kind': 'speech', 'itemno': 0, 'speaker': 'Mr. SMITH',
+                    'speaker_bioguide': 'S000001', 'text': text,
+                }],
+            }, outfile)
+        speeches = process.process_speech_file(path, self.legislator_data)
+        self.assertEqual(len(speeches), 1)
+        return speeches[0]['text']
+
+    def test_prefix(self):
+        self.assertEqual(
+            self.clean_text('Mr. SMITH. Mr. Speaker, I rise today.'),
+            'Mr. Speaker, I rise today.')
+
+    def test_mid_text(self):
+        """
+        If the name is not a prefix, only its first occurrence is removed
+        """
+        self.assertEqual(
+            self.clean_text('Madam Speaker, Mr. SMITH rises.'),
+            'Madam Speaker, rises.')
+
+    def test_later_mentions_kept(self):
+        """
+        Mentions after the one removed stay in the text
+        """
+        self.assertEqual(
+            self.clean_text('Mr. SMITH. I yield to Mr. SMITH of Texas.'),
+            'I yield to Mr. SMITH of Texas.')
+        self.assertEqual(
+            self.clean_text('Madam Speaker, Mr. SMITH thanks Mr. SMITH.'),
+            'Madam Speaker, thanks Mr. SMITH.')